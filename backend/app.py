@@ -9,6 +9,13 @@ import logging
 from googleapiclient.discovery import build
 import base64
 import tempfile
+import time
+import math
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 # Cargar variables de entorno
 load_dotenv()
@@ -270,6 +277,158 @@ def extract_with_fallback(url):
     raise Exception("No se pudo obtener información del video después de intentar múltiples estrategias")
 
 
+# === Control de admisión para extracciones yt-dlp ===
+
+# Máximo de extracciones simultáneas por proceso (cada worker de gunicorn tiene el suyo)
+EXTRACTION_MAX_CONCURRENT = int(os.getenv('EXTRACTION_MAX_CONCURRENT', 4))
+# Máximo de peticiones esperando turno; más allá se responde 503 inmediatamente
+EXTRACTION_QUEUE_SIZE = int(os.getenv('EXTRACTION_QUEUE_SIZE', 16))
+# Espera máxima en cola (segundos); debe ser menor que el timeout de gunicorn
+EXTRACTION_QUEUE_TIMEOUT = float(os.getenv('EXTRACTION_QUEUE_TIMEOUT', 10))
+
+# Prioridades (menor = se atiende antes)
+PRIORITY_INTERACTIVE = 0  # /api/video-info y /api/direct-url de un solo video
+PRIORITY_REFRESH = 1      # refresco de playlist al cargar la página
+PRIORITY_PREFETCH = 2     # refresco anticipado en segundo plano
+
+
+class AdmissionRejected(Exception):
+    """La extracción no puede atenderse a tiempo; se debe responder 503 con Retry-After."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Limita las extracciones concurrentes y mantiene una cola acotada con prioridad y plazo."""
+
+    def __init__(self, max_concurrent, max_queue, timeout, initial_service_time=5.0):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = []  # heap de (prioridad, secuencia)
+        self._shed = set()  # secuencias expulsadas por peticiones más prioritarias
+        self._seq = itertools.count()
+        # Media móvil exponencial de la duración de una extracción
+        self._service_time = initial_service_time
+        self._stats = {'admitted': 0, 'rejected_full': 0, 'rejected_deadline': 0,
+                       'timed_out': 0, 'shed': 0, 'total_wait': 0.0, 'max_wait': 0.0}
+
+    def _estimated_wait(self, ahead):
+        return (ahead + 1) * self._service_time / self.max_concurrent
+
+    def _retry_after(self):
+        return max(1, int(math.ceil(self._estimated_wait(len(self._waiting)))))
+
+    def _reject(self, reason, message):
+        self._stats[reason] += 1
+        retry_after = self._retry_after()
+        logger.warning(f"Extracción rechazada ({reason}): {message}; Retry-After={retry_after}s")
+        return AdmissionRejected(message, retry_after)
+
+    def _acquire(self, priority, timeout):
+        start = time.monotonic()
+        deadline = start + timeout
+        with self._cond:
+            if self._active < self.max_concurrent and not self._waiting:
+                self._admit(start)
+                return
+            worst = None
+            if len(self._waiting) >= self.max_queue:
+                worst = max(self._waiting) if self._waiting else None
+                if worst is None or worst[0] <= priority:
+                    raise self._reject('rejected_full', 'Cola de extracción llena')
+            # Comprobar el plazo antes de expulsar a nadie; el expulsado nunca va por delante
+            ahead = sum(1 for p, _ in self._waiting if p <= priority)
+            if self._estimated_wait(ahead) > timeout:
+                raise self._reject('rejected_deadline', 'El tiempo de espera estimado supera el plazo')
+            if worst is not None:
+                # Expulsar al de menor prioridad para dejar sitio a esta petición
+                self._waiting.remove(worst)
+                heapq.heapify(self._waiting)
+                self._shed.add(worst[1])
+                self._cond.notify_all()
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._waiting, entry)
+            while True:
+                if entry[1] in self._shed:
+                    self._shed.discard(entry[1])
+                    raise self._reject('shed', 'Desplazada por peticiones más prioritarias')
+                if self._active < self.max_concurrent and self._waiting[0] == entry:
+                    heapq.heappop(self._waiting)
+                    self._admit(start)
+                    # Puede quedar otro hueco libre para el siguiente en la cola
+                    self._cond.notify_all()
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                    raise self._reject('timed_out', 'Plazo de espera agotado')
+                self._cond.wait(remaining)
+
+    def _admit(self, start):
+        waited = time.monotonic() - start
+        self._active += 1
+        self._stats['admitted'] += 1
+        self._stats['total_wait'] += waited
+        self._stats['max_wait'] = max(self._stats['max_wait'], waited)
+
+    def _release(self, elapsed):
+        with self._cond:
+            self._active -= 1
+            self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority=PRIORITY_INTERACTIVE, timeout=None):
+        """Bloquea hasta obtener turno de extracción o lanza AdmissionRejected."""
+        self._acquire(priority, self.timeout if timeout is None else timeout)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - start)
+
+    def snapshot(self):
+        """Estado actual de la cola, útil para dimensionar los workers."""
+        with self._cond:
+            stats = dict(self._stats)
+            admitted = stats.pop('admitted')
+            total_wait = stats.pop('total_wait')
+            max_wait = stats.pop('max_wait')
+            return {
+                'active': self._active,
+                'queued': len(self._waiting),
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'queue_timeout': self.timeout,
+                'admitted': admitted,
+                'rejected': stats,
+                'avg_wait_ms': round(1000 * total_wait / admitted, 1) if admitted else 0.0,
+                'max_wait_ms': round(1000 * max_wait, 1),
+                'avg_extraction_s': round(self._service_time, 2),
+            }
+
+
+extraction_admission = AdmissionController(EXTRACTION_MAX_CONCURRENT, EXTRACTION_QUEUE_SIZE, EXTRACTION_QUEUE_TIMEOUT)
+
+
+def extract_with_admission(url, priority=PRIORITY_INTERACTIVE, timeout=None):
+    """extract_with_fallback sujeto al control de admisión del proceso."""
+    with extraction_admission.slot(priority, timeout):
+        return extract_with_fallback(url)
+
+
+def busy_response(e: AdmissionRejected):
+    """Respuesta 503 con Retry-After para peticiones rechazadas por falta de capacidad."""
+    return jsonify({'error': f'Servidor ocupado, intenta de nuevo: {str(e)}', 'retry_after': e.retry_after}), 503, {'Retry-After': str(e.retry_after)}
+
+
 def get_video_info_hybrid(url):
     """Método híbrido: API de YouTube primero, fallback a yt-dlp"""
     # Verificar si es YouTube
@@ -284,7 +443,7 @@ def get_video_info_hybrid(url):
     
     # Fallback a yt-dlp para YouTube sin API o TikTok
     logger.info("Usando fallback yt-dlp")
-    ydl_info = extract_with_fallback(url)
+    ydl_info = extract_with_admission(url, PRIORITY_INTERACTIVE)
     return ydl_info, False  # False indica que vino de yt-dlp
 
 
@@ -352,6 +511,8 @@ def get_video_info():
             
             return jsonify(video_info)
             
+        except AdmissionRejected as e:
+            return busy_response(e)
         except Exception as e:
             logger.error(f"Error al extraer info: {str(e)}")
             return jsonify({'error': f'Video no disponible o bloqueado: {str(e)}'}), 400
@@ -421,6 +582,33 @@ def _pick_direct_format(info_dict, quality: str, format_type: str):
 
 # === Endpoint: devolver URL directa ===
 
+def resolve_direct_url(url: str, quality: str = 'best', format_type: str = 'mp4', priority: int = PRIORITY_INTERACTIVE,
+                       timeout: float = None):
+    """Extrae y selecciona el formato directo; devuelve el payload usado por /api/direct-url.
+
+    timeout limita la espera en la cola de admisión (por defecto EXTRACTION_QUEUE_TIMEOUT).
+    """
+    url = normalize_url(url)
+    # Reutilizar la extracción robusta que ya funciona en /api/video-info
+    info = extract_with_admission(url, priority, timeout)
+    selected = _pick_direct_format(info, quality, format_type)
+    direct = selected.get('url')
+    if not direct:
+        raise Exception('No se obtuvo URL directa del formato seleccionado')
+    title = (info.get('title') or 'video').strip()
+    safe_title = re.sub(r'[\\/:*?"<>|]+', '_', title).strip('_.') or 'video'
+    ext = selected.get('ext') or ('m4a' if format_type in ('mp3', 'audio', 'bestaudio') else 'mp4')
+    return {
+        'direct_url': direct,
+        'filename': f"{safe_title}.{ext}",
+        'ext': ext,
+        'format_id': selected.get('format_id'),
+        'height': selected.get('height'),
+        'expires_at': direct_url_expiry(direct),
+        'source': 'yt_dlp'
+    }
+
+
 @app.route('/api/direct-url', methods=['POST'])
 def direct_url():
     try:
@@ -430,29 +618,216 @@ def direct_url():
         format_type = str(data.get('format', 'mp4')).lower()
         if not url or not is_valid_url(url):
             return jsonify({'error': 'URL no válida'}), 400
-        url = normalize_url(url)
-        # Reutilizar la extracción robusta que ya funciona en /api/video-info
-        info = extract_with_fallback(url)
-        selected = _pick_direct_format(info, quality, format_type)
-        direct = selected.get('url')
-        if not direct:
-            raise Exception('No se obtuvo URL directa del formato seleccionado')
-        title = (info.get('title') or 'video').strip()
-        safe_title = re.sub(r'[\\/:*?"<>|]+', '_', title).strip('_.') or 'video'
-        ext = selected.get('ext') or ('m4a' if format_type in ('mp3', 'audio', 'bestaudio') else 'mp4')
-        return jsonify({
-            'direct_url': direct,
-            'filename': f"{safe_title}.{ext}",
-            'ext': ext,
-            'format_id': selected.get('format_id'),
-            'height': selected.get('height'),
-            'source': 'yt_dlp'
-        })
+        return jsonify(resolve_direct_url(url, quality, format_type))
+    except AdmissionRejected as e:
+        return busy_response(e)
     except Exception as e:
         logger.error(f"Error al obtener enlace directo: {str(e)}")
         return jsonify({'error': f'No se pudo obtener enlace directo: {str(e)}'}), 400
 
 
+# === Refresco de URLs directas de la playlist ===
+
+# Segundos antes de la expiración a partir de los cuales una URL se considera vencida
+DIRECT_URL_REFRESH_MARGIN = int(os.getenv('DIRECT_URL_REFRESH_MARGIN', 600))  # 10 minutos
+# Ventana más amplia usada por el modo prefetch (refresco anticipado en segundo plano)
+DIRECT_URL_PREFETCH_MARGIN = int(os.getenv('DIRECT_URL_PREFETCH_MARGIN', 1800))  # 30 minutos
+# Máximo de extracciones concurrentes por petición de refresco
+PLAYLIST_REFRESH_WORKERS = int(os.getenv('PLAYLIST_REFRESH_WORKERS', 4))
+PLAYLIST_REFRESH_MAX_ITEMS = int(os.getenv('PLAYLIST_REFRESH_MAX_ITEMS', 200))
+# Extracciones máximas y presupuesto de tiempo por petición; el resto queda 'pending' para otra llamada
+PLAYLIST_REFRESH_MAX_EXTRACTIONS = int(os.getenv('PLAYLIST_REFRESH_MAX_EXTRACTIONS', 8))
+PLAYLIST_REFRESH_BUDGET = float(os.getenv('PLAYLIST_REFRESH_BUDGET', 20))  # segundos
+# Vida asumida de una URL directa cuando ni la URL ni el cliente indican su expiración
+DIRECT_URL_DEFAULT_TTL = int(os.getenv('DIRECT_URL_DEFAULT_TTL', 6 * 3600))  # 6 horas
+# Espera antes de reintentar una entrada que falló; se duplica con cada fallo consecutivo
+PLAYLIST_REFRESH_ERROR_BACKOFF = int(os.getenv('PLAYLIST_REFRESH_ERROR_BACKOFF', 300))  # 5 minutos
+PLAYLIST_REFRESH_ERROR_BACKOFF_MAX = int(os.getenv('PLAYLIST_REFRESH_ERROR_BACKOFF_MAX', 24 * 3600))  # 1 día
+
+
+def direct_url_expiry(direct: str):
+    """Devuelve el timestamp (epoch) de expiración de una URL directa (googlevideo o CDN de TikTok), o None si no se conoce."""
+    try:
+        if not direct:
+            return None
+        parts = urlsplit(direct)
+        q = dict(parse_qsl(parts.query))
+        if q.get('expire', '').isdigit():
+            return int(q['expire'])
+        # CDN de TikTok
+        if q.get('x-expires', '').isdigit():
+            return int(q['x-expires'])
+        # Algunas URLs codifican los parámetros en la ruta: /videoplayback/expire/1700000000/...
+        match = re.search(r'/expire/(\d+)', parts.path)
+        if match:
+            return int(match.group(1))
+        return None
+    except Exception:
+        return None
+
+
+def _client_timestamp(value):
+    """Normaliza un timestamp enviado por el cliente (segundos o milisegundos) a segundos, o None."""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    if value <= 0:
+        return None
+    return value // 1000 if value > 10 ** 11 else value
+
+
+def playlist_item_expiry(item):
+    """Expiración de una entrada: la de su URL, la guardada por el cliente o added_at + DIRECT_URL_DEFAULT_TTL."""
+    expires_at = direct_url_expiry(item.get('url'))
+    if expires_at is None:
+        expires_at = _client_timestamp(item.get('expires_at'))
+    if expires_at is None:
+        added_at = _client_timestamp(item.get('added_at'))
+        if added_at is not None:
+            expires_at = added_at + DIRECT_URL_DEFAULT_TTL
+    return expires_at
+
+
+def playlist_item_backoff_until(item):
+    """Momento (epoch) hasta el que no se debe reintentar una entrada que falló, o None."""
+    try:
+        failures = int(item.get('failures') or 0)
+    except (TypeError, ValueError):
+        failures = 0
+    last_error_at = _client_timestamp(item.get('last_error_at'))
+    if failures <= 0 or last_error_at is None:
+        return None
+    delay = min(PLAYLIST_REFRESH_ERROR_BACKOFF * 2 ** min(failures - 1, 16), PLAYLIST_REFRESH_ERROR_BACKOFF_MAX)
+    return last_error_at + delay
+
+
+def refresh_playlist(items, margin: int = DIRECT_URL_REFRESH_MARGIN, max_workers: int = PLAYLIST_REFRESH_WORKERS,
+                     priority: int = PRIORITY_REFRESH, skip_unknown: bool = False,
+                     max_extractions: int = PLAYLIST_REFRESH_MAX_EXTRACTIONS, budget: float = PLAYLIST_REFRESH_BUDGET):
+    """Vuelve a resolver solo las entradas cuya URL directa expiró o está por expirar.
+
+    Cada item debe traer 'source_url' (URL original del video), 'url' (URL directa guardada)
+    y opcionalmente 'quality', 'format', 'expires_at', 'added_at', 'failures' y 'last_error_at'.
+    Con skip_unknown (modo prefetch) las entradas sin expiración conocida no se tocan. Las que
+    fallaron hace poco se devuelven como 'backoff' sin extraer y, pasada la espera, van detrás
+    de las que nunca fallaron. Se resuelven como mucho
+    max_extractions URLs y ninguna espera turno de extracción más allá de budget segundos; las demás se
+    devuelven como 'pending' para que el cliente vuelva a llamar. Devuelve una lista con un
+    resultado por item, en el mismo orden de entrada.
+    """
+    now = int(time.time())
+    results = [None] * len(items)
+    pending = {}  # (source_url, quality, format) -> [índices]
+    due_expiry = {}
+    failed_before = set()
+    for idx, item in enumerate(items):
+        item = item if isinstance(item, dict) else {}
+        expires_at = playlist_item_expiry(item)
+        source_url = item.get('source_url')
+        if expires_at is not None and expires_at - now > margin:
+            results[idx] = {'index': idx, 'status': 'fresh', 'expires_at': expires_at}
+            continue
+        if expires_at is None and skip_unknown:
+            results[idx] = {'index': idx, 'status': 'skipped', 'expires_at': None,
+                            'error': 'Expiración desconocida'}
+            continue
+        if not isinstance(source_url, str) or not source_url or not is_valid_url(source_url):
+            results[idx] = {'index': idx, 'status': 'skipped', 'expires_at': expires_at,
+                            'error': 'Falta la URL original del video'}
+            continue
+        backoff_until = playlist_item_backoff_until(item)
+        if backoff_until is not None and backoff_until > now:
+            results[idx] = {'index': idx, 'status': 'backoff', 'expires_at': expires_at,
+                            'retry_at': backoff_until}
+            continue
+        key = (source_url, str(item.get('quality') or 'best'), str(item.get('format') or 'mp4').lower())
+        pending.setdefault(key, []).append(idx)
+        if backoff_until is not None:
+            failed_before.add(key)
+        # Sin expiración conocida se trata como ya vencida
+        due_expiry[key] = min(due_expiry.get(key, float('inf')), expires_at if expires_at is not None else now)
+
+    if not pending:
+        return results
+
+    # Primero las que nunca fallaron y, dentro de cada grupo, las que expiran antes
+    ordered = sorted(pending, key=lambda k: (k in failed_before, due_expiry[k]))
+    for key in ordered[max(0, max_extractions):]:
+        for idx in pending[key]:
+            results[idx] = {'index': idx, 'status': 'pending'}
+    ordered = ordered[:max(0, max_extractions)]
+    if not ordered:
+        return results
+    logger.info(f"Refrescando {len(ordered)} URL(s) directas de {len(items)} entradas de playlist")
+    deadline = time.monotonic() + budget
+
+    def resolve(key):
+        source_url, quality, format_type = key
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None, None
+        try:
+            # La espera en cola también descuenta del presupuesto de la llamada
+            timeout = min(extraction_admission.timeout, remaining)
+            return resolve_direct_url(source_url, quality, format_type, priority, timeout), None
+        except AdmissionRejected as e:
+            return None, e
+        except Exception as e:
+            logger.warning(f"No se pudo refrescar {source_url}: {str(e)}")
+            return None, str(e)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(ordered)))) as pool:
+        for key, (payload, error) in zip(ordered, pool.map(resolve, ordered)):
+            for idx in pending[key]:
+                if payload:
+                    results[idx] = {'index': idx, 'status': 'refreshed', **payload}
+                elif error is None:
+                    results[idx] = {'index': idx, 'status': 'pending'}
+                elif isinstance(error, AdmissionRejected):
+                    results[idx] = {'index': idx, 'status': 'busy', 'error': str(error),
+                                    'retry_after': error.retry_after}
+                else:
+                    results[idx] = {'index': idx, 'status': 'error', 'error': error}
+    return results
+
+
+@app.route('/api/playlist/refresh', methods=['POST'])
+def playlist_refresh():
+    """Recibe la playlist guardada y devuelve URLs directas nuevas solo para las entradas que lo necesitan."""
+    try:
+        data = request.get_json() or {}
+        items = data.get('items')
+        if not isinstance(items, list):
+            return jsonify({'error': 'Falta la lista de items'}), 400
+        if len(items) > PLAYLIST_REFRESH_MAX_ITEMS:
+            return jsonify({'error': f'Máximo {PLAYLIST_REFRESH_MAX_ITEMS} items por petición'}), 400
+        prefetch = bool(data.get('prefetch', False))
+        margin = DIRECT_URL_PREFETCH_MARGIN if prefetch else DIRECT_URL_REFRESH_MARGIN
+        results = refresh_playlist(items, margin=margin,
+                                   priority=PRIORITY_PREFETCH if prefetch else PRIORITY_REFRESH,
+                                   skip_unknown=prefetch)
+        refreshed = sum(1 for r in results if r['status'] == 'refreshed')
+        pending = sum(1 for r in results if r['status'] == 'pending')
+        busy = [r for r in results if r['status'] == 'busy']
+        body = {'results': results, 'refreshed': refreshed, 'pending': pending, 'prefetch': prefetch}
+        if busy and not refreshed:
+            # Nada pudo atenderse por falta de capacidad: devolver 503 para que el cliente reintente
+            retry_after = max(r['retry_after'] for r in busy)
+            body.update({'error': 'Servidor ocupado, intenta de nuevo', 'retry_after': retry_after})
+            return jsonify(body), 503, {'Retry-After': str(retry_after)}
+        return jsonify(body)
+    except Exception as e:
+        logger.error(f"Error en /api/playlist/refresh: {e}")
+        return jsonify({'error': f'No se pudo refrescar la playlist: {str(e)}'}), 500
+
+
+@app.route('/api/admission-stats', methods=['GET'])
+def admission_stats():
+    """Profundidad de cola y tiempos de espera de las extracciones de este proceso."""
+    return jsonify({'pid': os.getpid(), **extraction_admission.snapshot()})
+
+
 # === Búsqueda por nombre ===
 
 def youtube_search_api(query: str, max_results: int = 10):
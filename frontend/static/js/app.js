@@ -33,13 +33,19 @@ const searchTypeSelect = document.getElementById('searchType');
 
 // Estado global
 let currentVideoInfo = null;
-let playlist = []; // [{title, url, ext, duration, uploader, thumbnail, addedAt}]
+let playlist = []; // [{title, url, ext, duration, uploader, thumbnail, addedAt, sourceUrl, quality, format, expiresAt, resolvedAt, failures, lastErrorAt}]
 let currentIndex = -1;
+// Refresco anticipado de URLs directas en segundo plano (ms)
+const PLAYLIST_PREFETCH_INTERVAL = 5 * 60 * 1000;
+let playlistRefreshing = false;
+let playlistRetryTimer = null;
+let playlistRetryQueued = null; // modo (prefetch o no) de un reintento que llegó con un refresco en curso
 
 // Inicialización
 document.addEventListener('DOMContentLoaded', function() {
     setupEventListeners();
     loadPlaylist();
+    setInterval(() => refreshPlaylist(true), PLAYLIST_PREFETCH_INTERVAL);
 
     // Auto-pegar desde portapapeles
     if (navigator.clipboard && navigator.clipboard.readText) {
@@ -190,6 +196,10 @@ async function addToPlaylist() {
             url: data.direct_url,
             ext: data.ext || (format === 'mp3' ? 'm4a' : 'mp4'),
             addedAt: Date.now(),
+            sourceUrl: url,
+            quality,
+            format,
+            expiresAt: data.expires_at || null,
         };
         playlist.push(item);
         savePlaylist();
@@ -211,6 +221,88 @@ function savePlaylist() { localStorage.setItem('playlist', JSON.stringify(playli
 function loadPlaylist() {
     try { playlist = JSON.parse(localStorage.getItem('playlist') || '[]'); } catch { playlist = []; }
     renderPlaylist();
+    refreshPlaylist(false);
+}
+
+// Re-resolver en el servidor solo las URLs directas vencidas o por vencer
+async function refreshPlaylist(prefetch = false) {
+    if (!playlist.length || playlistRefreshing) return;
+    playlistRefreshing = true;
+    try {
+        // El servidor resuelve un lote por llamada; seguir mientras queden 'pending' y haya progreso.
+        // Los fallos quedan registrados y en la siguiente llamada van a 'backoff', liberando el lote.
+        let data;
+        do {
+            data = await requestPlaylistRefresh(playlist.slice(), prefetch);
+        } while (data.pending > 0 && (data.refreshed > 0 || data.errors > 0));
+        // Entradas rechazadas por falta de capacidad: reintentar cuando indique el servidor
+        const busy = (data.results || []).filter(r => r.status === 'busy');
+        if (busy.length) schedulePlaylistRetry(Math.max(...busy.map(r => r.retry_after || 1)), prefetch);
+    } catch (e) {
+        console.warn('Refresco de playlist falló:', e);
+        if (e.retryAfter) schedulePlaylistRetry(e.retryAfter, prefetch);
+    } finally {
+        playlistRefreshing = false;
+        if (playlistRetryQueued !== null) {
+            const queuedPrefetch = playlistRetryQueued;
+            playlistRetryQueued = null;
+            refreshPlaylist(queuedPrefetch);
+        }
+    }
+}
+
+function schedulePlaylistRetry(seconds, prefetch) {
+    if (playlistRetryTimer) return;
+    playlistRetryTimer = setTimeout(() => {
+        playlistRetryTimer = null;
+        if (playlistRefreshing) {
+            // Ejecutarlo al terminar el refresco en curso en vez de perderlo
+            playlistRetryQueued = playlistRetryQueued === false ? false : prefetch;
+            return;
+        }
+        refreshPlaylist(prefetch);
+    }, Math.max(1, seconds) * 1000);
+}
+
+async function requestPlaylistRefresh(snapshot, prefetch) {
+    const items = snapshot.map(item => ({
+        source_url: item.sourceUrl, url: item.url, quality: item.quality, format: item.format,
+        expires_at: item.expiresAt || null, added_at: item.resolvedAt || item.addedAt || null,
+        failures: item.failures || 0, last_error_at: item.lastErrorAt || null,
+    }));
+    const resp = await fetch(`${API_BASE}/api/playlist/refresh`, {
+        method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ items, prefetch })
+    });
+    const data = await resp.json();
+    if (!resp.ok) {
+        const err = new Error(data.error || 'No se pudo refrescar la playlist');
+        if (resp.status === 503) err.retryAfter = data.retry_after || parseInt(resp.headers.get('Retry-After'), 10) || 1;
+        throw err;
+    }
+    let changed = false;
+    data.errors = 0;
+    (data.results || []).forEach(r => {
+        const item = snapshot[r.index];
+        if (!item) return;
+        if (r.status === 'error') {
+            // Recordar el fallo para que el servidor espere antes de reintentar (videos borrados o privados)
+            item.failures = (item.failures || 0) + 1;
+            item.lastErrorAt = Date.now();
+            data.errors += 1;
+            changed = true;
+            return;
+        }
+        if (r.status !== 'refreshed' || !r.direct_url) return;
+        item.url = r.direct_url;
+        item.ext = r.ext || item.ext;
+        item.expiresAt = r.expires_at || null;
+        item.resolvedAt = Date.now();
+        delete item.failures;
+        delete item.lastErrorAt;
+        changed = true;
+    });
+    if (changed) savePlaylist();
+    return data;
 }
 
 function renderPlaylist() {
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Igual que wsgi.py: permitir importar backend.app desde la raíz del proyecto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,138 @@
+import threading
+import time
+
+import pytest
+
+from backend.app import AdmissionController, AdmissionRejected
+
+
+def _hold_slot(controller, priority=0):
+    """Ocupa un turno en otro hilo hasta que se libere el evento devuelto."""
+    acquired, release = threading.Event(), threading.Event()
+
+    def run():
+        with controller.slot(priority):
+            acquired.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    assert acquired.wait(5)
+    return release, thread
+
+
+def _wait_in_queue(controller, priority, outcome):
+    def run():
+        try:
+            with controller.slot(priority):
+                outcome.append('admitted')
+        except AdmissionRejected as e:
+            outcome.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def _wait_for_queued(controller, n):
+    for _ in range(500):
+        if controller.snapshot()['queued'] == n:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f'la cola no llegó a {n}')
+
+
+def test_full_queue_rejects_same_priority():
+    controller = AdmissionController(1, 1, timeout=5, initial_service_time=0.1)
+    release, holder = _hold_slot(controller)
+    outcome = []
+    waiter = _wait_in_queue(controller, 1, outcome)
+    _wait_for_queued(controller, 1)
+
+    with pytest.raises(AdmissionRejected) as exc:
+        with controller.slot(1):
+            pass
+    assert exc.value.retry_after >= 1
+    assert controller.snapshot()['rejected']['rejected_full'] == 1
+
+    release.set()
+    holder.join()
+    waiter.join()
+    assert outcome == ['admitted']
+
+
+def test_full_queue_sheds_lower_priority_waiter():
+    controller = AdmissionController(1, 1, timeout=5, initial_service_time=0.1)
+    release, holder = _hold_slot(controller)
+    shed = []
+    low = _wait_in_queue(controller, 2, shed)
+    _wait_for_queued(controller, 1)
+
+    admitted = []
+    high = _wait_in_queue(controller, 0, admitted)
+    low.join(5)
+    assert len(shed) == 1 and isinstance(shed[0], AdmissionRejected)
+
+    release.set()
+    holder.join()
+    high.join()
+    assert admitted == ['admitted']
+    stats = controller.snapshot()
+    assert stats['rejected']['shed'] == 1
+    assert stats['queued'] == 0
+
+
+def test_rejects_when_estimated_wait_exceeds_deadline():
+    controller = AdmissionController(1, 4, timeout=1, initial_service_time=10)
+    release, holder = _hold_slot(controller)
+    start = time.monotonic()
+    with pytest.raises(AdmissionRejected):
+        with controller.slot(0):
+            pass
+    # Se rechaza sin esperar el plazo completo
+    assert time.monotonic() - start < 0.5
+    stats = controller.snapshot()
+    assert stats['rejected']['rejected_deadline'] == 1
+    assert stats['queued'] == 0
+    release.set()
+    holder.join()
+
+
+def test_timed_out_waiter_leaves_the_queue():
+    controller = AdmissionController(1, 4, timeout=0.2, initial_service_time=0.05)
+    release, holder = _hold_slot(controller)
+    with pytest.raises(AdmissionRejected):
+        with controller.slot(0):
+            pass
+    stats = controller.snapshot()
+    assert stats['rejected']['timed_out'] == 1
+    assert stats['queued'] == 0
+
+    release.set()
+    holder.join()
+    # Tras la limpieza el siguiente entra directamente
+    with controller.slot(0):
+        assert controller.snapshot()['active'] == 1
+
+
+def test_deadline_rejection_does_not_shed_waiter():
+    controller = AdmissionController(1, 1, timeout=5, initial_service_time=0.1)
+    release, holder = _hold_slot(controller)
+    low = []
+    waiter = _wait_in_queue(controller, 2, low)
+    _wait_for_queued(controller, 1)
+
+    # La media de extracción sube durante la ráfaga
+    controller._service_time = 10
+    with pytest.raises(AdmissionRejected):
+        with controller.slot(0, timeout=1):
+            pass
+    stats = controller.snapshot()
+    assert stats['rejected']['rejected_deadline'] == 1
+    assert stats['rejected']['shed'] == 0
+    assert stats['queued'] == 1
+
+    release.set()
+    holder.join()
+    waiter.join()
+    assert low == ['admitted']
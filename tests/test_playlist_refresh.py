@@ -0,0 +1,157 @@
+import time
+
+import backend.app as app_module
+
+
+def _direct(expire):
+    return f'https://rr1---sn-x.googlevideo.com/videoplayback?expire={expire}&id=abc'
+
+
+def _fake_resolver(calls):
+    def resolve(url, quality='best', format_type='mp4', priority=0, timeout=None):
+        calls.append(url)
+        return {'direct_url': _direct(int(time.time()) + 21600), 'ext': 'mp4', 'expires_at': int(time.time()) + 21600}
+    return resolve
+
+
+def test_refresh_orders_by_soonest_expiry(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app_module, 'resolve_direct_url', _fake_resolver(calls))
+    now = int(time.time())
+    items = [
+        {'source_url': 'https://www.youtube.com/watch?v=aaaaaaaaaaa', 'url': _direct(now + 1500)},
+        {'source_url': 'https://www.youtube.com/watch?v=bbbbbbbbbbb', 'url': _direct(now + 200)},
+        {'source_url': 'https://www.youtube.com/watch?v=ccccccccccc', 'url': _direct(now + 900)},
+    ]
+    results = app_module.refresh_playlist(items, margin=1800, max_workers=1)
+    assert [c[-3:] for c in calls] == ['bbb', 'ccc', 'aaa']
+    assert [r['status'] for r in results] == ['refreshed'] * 3
+
+
+def test_refresh_skips_fresh_entries(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app_module, 'resolve_direct_url', _fake_resolver(calls))
+    now = int(time.time())
+    items = [
+        {'source_url': 'https://www.youtube.com/watch?v=aaaaaaaaaaa', 'url': _direct(now + 20000)},
+        {'source_url': 'https://www.youtube.com/watch?v=bbbbbbbbbbb', 'url': _direct(now - 10)},
+    ]
+    results = app_module.refresh_playlist(items, margin=600, max_workers=1)
+    assert [r['status'] for r in results] == ['fresh', 'refreshed']
+    assert len(calls) == 1
+
+
+def test_direct_url_expiry_reads_tiktok_param():
+    url = 'https://v16-webapp.tiktok.com/video/tos/abc/?a=1988&x-expires=1700000000&x-signature=xyz'
+    assert app_module.direct_url_expiry(url) == 1700000000
+
+
+def test_unknown_expiry_falls_back_to_client_timestamps(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app_module, 'resolve_direct_url', _fake_resolver(calls))
+    now = int(time.time())
+    items = [
+        {'source_url': 'https://www.tiktok.com/@u/video/1', 'url': 'https://cdn.example/v.mp4', 'expires_at': now + 20000},
+        {'source_url': 'https://www.tiktok.com/@u/video/2', 'url': 'https://cdn.example/v.mp4', 'added_at': now * 1000},
+        {'source_url': 'https://www.tiktok.com/@u/video/3', 'url': 'https://cdn.example/v.mp4'},
+    ]
+    results = app_module.refresh_playlist(items, margin=600, max_workers=1)
+    assert [r['status'] for r in results] == ['fresh', 'fresh', 'refreshed']
+    assert calls == ['https://www.tiktok.com/@u/video/3']
+
+
+def test_prefetch_skips_unknown_expiry(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app_module, 'resolve_direct_url', _fake_resolver(calls))
+    items = [{'source_url': 'https://www.tiktok.com/@u/video/3', 'url': 'https://cdn.example/v.mp4'}]
+    results = app_module.refresh_playlist(items, margin=1800, skip_unknown=True)
+    assert results[0]['status'] == 'skipped'
+    assert calls == []
+
+
+def test_refresh_caps_extractions_per_call(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app_module, 'resolve_direct_url', _fake_resolver(calls))
+    now = int(time.time())
+    items = [{'source_url': f'https://www.youtube.com/watch?v=video{i:06d}', 'url': _direct(now - 100 + i)}
+             for i in range(5)]
+    results = app_module.refresh_playlist(items, max_workers=1, max_extractions=2)
+    assert [r['status'] for r in results] == ['refreshed', 'refreshed', 'pending', 'pending', 'pending']
+    assert len(calls) == 2
+
+
+def test_refresh_leaves_work_pending_after_budget(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app_module, 'resolve_direct_url', _fake_resolver(calls))
+    items = [{'source_url': 'https://www.youtube.com/watch?v=aaaaaaaaaaa', 'url': _direct(0)}]
+    results = app_module.refresh_playlist(items, max_workers=1, budget=-1)
+    assert results[0]['status'] == 'pending'
+    assert calls == []
+
+
+def test_failed_entries_back_off_and_let_live_entries_through(monkeypatch):
+    calls = []
+    fake = _fake_resolver(calls)
+
+    def resolve(url, quality='best', format_type='mp4', priority=0, timeout=None):
+        if 'dead' in url:
+            calls.append(url)
+            raise Exception('Video privado')
+        return fake(url, quality, format_type, priority)
+
+    monkeypatch.setattr(app_module, 'resolve_direct_url', resolve)
+    now = int(time.time())
+    dead = [{'source_url': f'https://www.youtube.com/watch?v=dead{i:07d}', 'url': _direct(now - 86400 + i)}
+            for i in range(8)]
+    live = [{'source_url': f'https://www.youtube.com/watch?v=live{i:07d}', 'url': _direct(now - 100 + i)}
+            for i in range(3)]
+    items = dead + live
+
+    first = app_module.refresh_playlist(items, max_workers=1, max_extractions=8)
+    assert [r['status'] for r in first] == ['error'] * 8 + ['pending'] * 3
+
+    # El cliente registra los fallos y vuelve a llamar
+    for item in dead:
+        item.update({'failures': 1, 'last_error_at': now * 1000})
+    calls.clear()
+    second = app_module.refresh_playlist(items, max_workers=1, max_extractions=8)
+    assert [r['status'] for r in second] == ['backoff'] * 8 + ['refreshed'] * 3
+    assert all('live' in c for c in calls)
+
+
+def test_entries_past_backoff_go_after_never_failed(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app_module, 'resolve_direct_url', _fake_resolver(calls))
+    now = int(time.time())
+    long_ago = (now - 10 * app_module.PLAYLIST_REFRESH_ERROR_BACKOFF_MAX) * 1000
+    items = [
+        {'source_url': 'https://www.youtube.com/watch?v=failedaaaaa', 'url': _direct(now - 86400),
+         'failures': 3, 'last_error_at': long_ago},
+        {'source_url': 'https://www.youtube.com/watch?v=neverfailed', 'url': _direct(now - 100)},
+    ]
+    results = app_module.refresh_playlist(items, max_workers=1, max_extractions=1)
+    assert [r['status'] for r in results] == ['pending', 'refreshed']
+    assert calls == ['https://www.youtube.com/watch?v=neverfailed']
+
+
+def test_queue_wait_is_bounded_by_remaining_budget(monkeypatch):
+    timeouts = []
+
+    def resolve(url, quality='best', format_type='mp4', priority=0, timeout=None):
+        timeouts.append(timeout)
+        return {'direct_url': _direct(int(time.time()) + 21600), 'ext': 'mp4'}
+
+    monkeypatch.setattr(app_module, 'resolve_direct_url', resolve)
+    items = [{'source_url': 'https://www.youtube.com/watch?v=aaaaaaaaaaa', 'url': _direct(0)}]
+    app_module.refresh_playlist(items, max_workers=1, budget=2)
+    assert len(timeouts) == 1
+    assert 0 < timeouts[0] <= 2
+
+
+def test_malformed_items_are_skipped(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app_module, 'resolve_direct_url', _fake_resolver(calls))
+    items = ['no-es-un-dict', {'source_url': 12345, 'url': _direct(0)}, {'source_url': ['x'], 'url': _direct(0)}]
+    results = app_module.refresh_playlist(items, max_workers=1)
+    assert [r['status'] for r in results] == ['skipped'] * 3
+    assert calls == []